@@ -0,0 +1,158 @@
+# Headless benchmark of the game loop
+#
+#   python -m carbench --frames 300 --output bench_results.json
+#
+# Every track is raced for a fixed number of frames with SDL's dummy video and
+# audio drivers, a scripted driver and a fixed frame time, so the car takes the
+# same path on every run and only the timings change.
+import argparse
+import json
+import os
+import time
+from dataclasses import replace
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import pygame as pg
+
+from main import Game, Profiler, RecordStore, Session, TrackRegistry
+
+# (first frame, keys held down) the script switches to the next keys at each first frame
+SCRIPT = (
+    (0, (pg.K_UP,)),
+    (90, (pg.K_UP, pg.K_LEFT)),
+    (120, (pg.K_UP,)),
+    (180, (pg.K_UP, pg.K_RIGHT)),
+    (210, (pg.K_UP,)),
+    (270, ()),
+)
+
+
+# Stands in for pg.key.get_pressed(), indexed by key constant
+class ScriptedKeys:
+
+    def __init__(self, down):
+        self.down = set(down)
+
+    def __getitem__(self, key):
+        return key in self.down
+
+
+# Stands in for pg.time.Clock, every frame takes the same time
+class FixedClock:
+
+    def __init__(self, frame_ms):
+        self.frame_ms = frame_ms
+
+    def tick(self, framerate=0):
+        return self.frame_ms
+
+    def get_rawtime(self):
+        return self.frame_ms
+
+    def get_fps(self):
+        return 1000 / self.frame_ms
+
+
+class BenchGame(Game):
+
+    def __init__(self, track, frames, options, frame_ms=16):
+        self.bench_track = track
+        self.bench_frames = frames
+        self.bench_options = options
+        # laps of a benchmark go to a throwaway store, not to race_records.db
+        super().__init__(Session(records=RecordStore(":memory:", legacy_path=None)))
+        self.clock = FixedClock(frame_ms)
+        self.frame_count = 0
+        self.bench_profiler = Profiler(size=frames)
+        self.bench_profiler.attach(self)
+
+    def load_settings(self):
+        super().load_settings()
+        self.config = replace(self.config, track=self.bench_track, profiler=False, **self.bench_options)
+
+    def read_keys(self):
+        down = ()
+        for first_frame, keys in SCRIPT:
+            if self.frame_count >= first_frame:
+                down = keys
+        return ScriptedKeys(down)
+
+    def check_events(self):
+        super().check_events()
+        self.frame_count += 1
+        if self.frame_count >= self.bench_frames:
+            self.running = False
+
+    # A benchmark lap is never a record
+    def save_record(self):
+        pass
+
+    # Crossing the finish line does not end the run, every track runs the full frames
+    def check_finish_line(self):
+        super().check_finish_line()
+        self.running = self.frame_count < self.bench_frames
+
+
+def summarize(samples):
+    ms = samples / 1e6
+    if not len(ms):
+        return {"count": 0}
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "max_ms": round(float(ms.max()), 4),
+    }
+
+
+def bench_track(track, frames, options):
+    game = BenchGame(track, frames, options)
+    start = time.perf_counter()
+    game.run()
+    elapsed = time.perf_counter() - start
+    durations = game.bench_profiler.recorded(game.bench_profiler.durations)
+    result = {name: summarize(durations[:, column]) for column, name in enumerate(Profiler.stages)}
+    result["frames"] = game.frame_count
+    result["fps"] = round(result["frames"] / elapsed, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmark of the game loop")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--tracks", type=int, nargs="+", default=[track.number for track in TrackRegistry()])
+    parser.add_argument("--renderer", choices=["numpy", "numba"])
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--hres", type=int)
+    parser.add_argument("--resolution")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    options = {}
+    if args.renderer:
+        options["renderer"] = args.renderer
+    if args.threads:
+        options["render_threads"] = args.threads
+    if args.hres:
+        options["hres"] = args.hres
+    if args.resolution:
+        options["width"], options["height"] = map(int, args.resolution.split("x"))
+
+    results = {"frames": args.frames, "options": options, "tracks": {}}
+    for track in args.tracks:
+        try:
+            results["tracks"][str(track)] = bench_track(track, args.frames, options)
+        except (FileNotFoundError, pg.error) as e:
+            results["tracks"][str(track)] = {"error": str(e)}
+        print(f"Track {track}: {results['tracks'][str(track)]}")
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,22 @@ from PIL import Image, ImageTk
 import numpy as np
 import pygame as pg
 import sys
+import os
 import json
+import time
+import bisect
+import hashlib
+import sqlite3
+import threading
+import atexit
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+try:
+    import numba
+except ImportError:
+    numba = None
 
 class Main:
 
@@ -22,6 +37,19 @@ class Main:
         self.track = IntVar()
         self.resolution = StringVar()
         self.show_fps = BooleanVar()
+        self.renderer = StringVar()
+        self.render_threads = IntVar()
+        self.hres = IntVar()
+        self.sky_interpolation = BooleanVar()
+        self.mipmaps = BooleanVar()
+        self.palette_mode = BooleanVar()
+        self.minimap_trail = IntVar()
+        self.profiler_enabled = BooleanVar()
+        self.profile_export = StringVar()
+        self.tick_rate = IntVar()
+        self.fps_cap = IntVar()
+        self.vsync = BooleanVar()
+        self.dynamic_resolution = BooleanVar()
         self.master_sound = IntVar()
         self.engine_sound = IntVar()
         self.tire_sound = IntVar()
@@ -45,120 +73,994 @@ class Main:
             self.track.set(settings.get("track", "1"))
             self.resolution.set(settings.get("resolution", "800x600"))
             self.show_fps.set(settings.get("fps"))
+            self.renderer.set(settings.get("renderer", "numpy"))
+            self.render_threads.set(settings.get("render_threads", 1))
+            self.hres.set(settings.get("hres", 120))
+            self.sky_interpolation.set(settings.get("sky_interpolation", False))
+            self.mipmaps.set(settings.get("mipmaps", True))
+            self.palette_mode.set(settings.get("palette_mode", False))
+            self.minimap_trail.set(settings.get("minimap_trail", 0))
+            self.profiler_enabled.set(settings.get("profiler", False))
+            self.profile_export.set(settings.get("profile_export", "none"))
+            self.tick_rate.set(settings.get("tick_rate", 60))
+            self.fps_cap.set(settings.get("fps_cap", 60))
+            self.vsync.set(settings.get("vsync", False))
+            self.dynamic_resolution.set(settings.get("dynamic_resolution", False))
 
         except FileNotFoundError:
             print("Settings file not found. Using default settings.")
 
-# class consists of game elements, load resources, UI, and handling car
-class Game(Main):
+# Settings from settings.json, keys missing there come from default_settings.json
+def read_settings():
+    settings = {}
+    for path in ("default_settings.json", "settings.json"):
+        try:
+            with open(path, "r") as file:
+                settings.update(json.load(file))
+        except (FileNotFoundError, json.JSONDecodeError):
+            print(f"Could not read {path}. Using default settings.")
+    return settings
+
+# Writes settings.json from a background thread once the settings stopped changing for
+# a quiet period, so dragging a slider costs one write instead of dozens. The file is
+# written next to settings.json and renamed over it, a crash leaves the old or the new
+# file but never half of one. Pending settings are written when closed or on exit
+class SettingsWriter:
+
+    def __init__(self, path="settings.json", quiet=0.5):
+        self.path = path
+        self.quiet = quiet
+        self.pending = None
+        self.version = 0
+        self.written = None
+        self.written_version = 0
+        self.deadline = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        # the file is written outside the condition, so save() never waits for a slow disk
+        self.io_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Queue the settings, every call restarts the quiet period
+    def save(self, settings):
+        with self.condition:
+            self.pending = settings
+            self.version += 1
+            self.deadline = time.monotonic() + self.quiet
+            self.condition.notify()
 
-    def __init__(self, show_fps):
-        super().__init__()
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and (self.pending is None or time.monotonic() < self.deadline):
+                    if self.pending is None:
+                        self.condition.wait()
+                    else:
+                        self.condition.wait(self.deadline - time.monotonic())
+                if self.closed:
+                    return
+                job = self.take()
+            self.write(*job)
+
+    # Write the pending settings now instead of after the quiet period
+    def flush(self):
+        with self.condition:
+            job = self.take()
+        self.write(*job)
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            job = self.take()
+            self.condition.notify()
+        self.thread.join()
+        self.write(*job)
+
+    def take(self):
+        settings, self.pending = self.pending, None
+        return settings, self.version
+
+    # Writes that lost the race to a newer version are skipped
+    def write(self, settings, version):
+        with self.io_lock:
+            if settings is None or version <= self.written_version or settings == self.written:
+                return
+            try:
+                with open(self.path + ".tmp", "w") as file:
+                    json.dump(settings, file)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(self.path + ".tmp", self.path)
+                self.written, self.written_version = settings, version
+            except OSError as e:
+                print(f"Could not save settings: {e}")
+
+# Plain copy of the settings taken when a race starts, so the game loop never
+# goes through Tk variables and every value is already in the form it is used in
+@dataclass(frozen=True)
+class GameConfig:
+    track: int
+    width: int
+    height: int
+    show_fps: bool
+    renderer: str
+    render_threads: int
+    hres: int
+    sky_interpolation: bool
+    mipmaps: bool
+    palette_mode: bool
+    minimap_trail: int
+    profiler: bool
+    profile_export: str
+    tick_rate: int
+    fps_cap: int
+    vsync: bool
+    dynamic_resolution: bool
+    forward_key: int
+    backward_key: int
+    left_key: int
+    right_key: int
+    steering: float
+    tire_volume: float
+    engine_volume: float
+
+    @classmethod
+    def from_settings(cls, settings):
+        width, height = map(int, settings.get("resolution", "800x600").split("x"))
+        return cls(
+            track=int(settings.get("track", 1)),
+            width=width,
+            height=height,
+            show_fps=bool(settings.get("fps")),
+            renderer=settings.get("renderer", "numpy"),
+            render_threads=int(settings.get("render_threads", 1)),
+            hres=max(1, int(settings.get("hres", 120))),
+            sky_interpolation=bool(settings.get("sky_interpolation")),
+            mipmaps=bool(settings.get("mipmaps", True)),
+            palette_mode=bool(settings.get("palette_mode")),
+            minimap_trail=int(settings.get("minimap_trail", 0)),
+            profiler=bool(settings.get("profiler")),
+            profile_export=settings.get("profile_export", "none"),
+            tick_rate=max(1, int(settings.get("tick_rate", 60))),
+            fps_cap=max(0, int(settings.get("fps_cap", 60))),
+            vsync=bool(settings.get("vsync")),
+            dynamic_resolution=bool(settings.get("dynamic_resolution")),
+            forward_key=cls.keycode(settings.get("forward_key", "W")),
+            backward_key=cls.keycode(settings.get("backward_key", "S")),
+            left_key=cls.keycode(settings.get("left_key", "A")),
+            right_key=cls.keycode(settings.get("right_key", "D")),
+            steering=0.003 * settings.get("steering", 5) / 5,
+            tire_volume=settings.get("tire_sound", 5),
+            engine_volume=settings.get("engine_sound", 5) / 10 * settings.get("master_sound", 5) / 10,
+        )
+
+    # pygame key code of a key name saved by the menu, like "W" or "Up"
+    @staticmethod
+    def keycode(name):
+        if len(name) == 1:
+            return ord(name.lower())
+        try:
+            return pg.key.key_code(name.lower())
+        except ValueError:
+            return 0
+
+# Per resolution tables used by the floorcaster, they only depend on the
+# horizontal resolution, the vertical resolution and the field of view
+class RayTables:
+
+    names = ("angles", "cos2", "ns", "shade", "footprint")
+    cache = {}
+
+    def __init__(self, hres, vres, fov, tables=None):
+        self.hres, self.vres, self.fov = hres, vres, fov
+        self.halfvres = vres // 2
+        if tables is None:
+            tables = self.build()
+        for name in self.names:
+            setattr(self, name, tables[name])
+
+    # Return the tables for a resolution, from memory, from disk or freshly built
+    @classmethod
+    def get(cls, hres, vres, fov=60, cache_dir="cache/rays"):
+        key = (hres, vres, fov)
+        if key not in cls.cache:
+            tables = cls.load(key, cache_dir) if cache_dir else None
+            cls.cache[key] = cls(hres, vres, fov, tables)
+            if cache_dir and tables is None:
+                cls.cache[key].save(cache_dir)
+        return cls.cache[key]
+
+    @classmethod
+    def path(cls, key, cache_dir, name):
+        hres, vres, fov = key
+        return os.path.join(cache_dir, f"rays_{hres}x{vres}_{fov}_{name}.npy")
+
+    @classmethod
+    def load(cls, key, cache_dir):
+        try:
+            return {name: np.load(cls.path(key, cache_dir, name)) for name in cls.names}
+        except (OSError, ValueError):
+            return None
+
+    def save(self, cache_dir):
+        key = (self.hres, self.vres, self.fov)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            for name in self.names:
+                np.save(self.path(key, cache_dir, name), getattr(self, name))
+        except OSError as e:
+            print(f"Could not save ray tables: {e}")
+
+    def build(self):
+        halfvres = self.halfvres
+        mod = self.hres / self.fov
+
+        # angle of every screen column relative to the car, and its perspective correction
+        angles = np.deg2rad(np.arange(self.hres) / mod - self.fov / 2)
+        cos2 = np.cos(angles)
+
+        # depth of every floor row, flipped so rows go from horizon to bottom
+        ns = halfvres / (halfvres + 0.1 - np.linspace(0, halfvres, halfvres))
+        ns = np.ascontiguousarray(np.flip(ns))
+
+        shade = 0.4 + 0.6 * (np.linspace(0, halfvres, halfvres) / halfvres)
+        shade = np.dstack((shade, shade, shade))
+
+        # floor texels covered by one pixel of every row, across the columns or
+        # towards the next row whichever is wider, for picking a mip level
+        spread = np.maximum(ns * np.deg2rad(self.fov / self.hres), np.abs(np.gradient(ns)))
+        footprint = spread * 1023 / 30
+        return {"angles": angles, "cos2": cos2, "ns": ns, "shade": shade, "footprint": footprint}
+
+# Numba version of the sky fill and floorcast, compiled on first use and cached on disk.
+# Screen columns are spread over numba's thread pool
+if numba is not None:
+
+    @numba.njit(cache=True, parallel=True)
+    def numba_surface(frame, sky, smooth_sky, mipmaps, offsets, levels, palette_mode, shaded_palette, posx, posy, rot, angles, cos2, ns, shade):
+        halfvres = ns.shape[0]
+        for i in numba.prange(angles.shape[0]):
+            rot_i = rot + angles[i]
+            sin, cos = np.sin(rot_i), np.cos(rot_i)
+            heading = np.rad2deg(rot_i) % 360
+            col = int(heading) % 360
+            col2, frac = (col + 1) % 360, heading - int(heading)
+            for j in range(halfvres):
+                x = posx + ns[j] * cos / cos2[i]
+                y = posy + ns[j] * sin / cos2[i]
+                xx, yy = int(x / 30 % 1 * 1023), int(y / 30 % 1 * 1023)
+                level = levels[j]
+                texel = offsets[level] + (xx >> level) * (1024 >> level) + (yy >> level)
+                for c in range(3):
+                    if smooth_sky:
+                        frame[i, j, c] = int(sky[col, j, c] * (1 - frac) + sky[col2, j, c] * frac)
+                    else:
+                        frame[i, j, c] = sky[col, j, c]
+                    if palette_mode:
+                        frame[i, halfvres + j, c] = shaded_palette[j * 256 + mipmaps[texel, 0], c]
+                    else:
+                        frame[i, halfvres + j, c] = (mipmaps[texel, c] * shade[0, j, c]) >> 8
+
+# Off-track mask of a track packed to one bit per texel, 128 KB instead of the 4 MB
+# int32 array. Positions are in world units, 34.13 texels per unit
+class CollisionGrid:
+
+    scale = 34.13
+
+    def __init__(self, bits):
+        self.size = bits.shape[0]
+        self.bits = bits
+
+    def texels(self, xs, ys):
+        ix = np.clip((np.asarray(xs) * self.scale).astype("int"), 0, self.size - 1)
+        iy = np.clip((np.asarray(ys) * self.scale).astype("int"), 0, self.size - 1)
+        return ix, iy
+
+    # True where the points are off the track, works on single points and batches of points
+    def blocked(self, xs, ys):
+        ix, iy = self.texels(xs, ys)
+        return ((self.bits[ix, iy >> 3] >> (7 - (iy & 7))) & 1) == 1
+
+    # True if the segment from the previous to the current position touches the
+    # border anywhere, so a fast car cannot jump over a thin wall
+    def swept(self, x0, y0, x1, y1):
+        steps = int(max(abs(x1 - x0), abs(y1 - y0)) * self.scale * 2) + 1
+        t = np.linspace(0, 1, steps + 1)[1:]
+        return bool(self.blocked(x0 + (x1 - x0) * t, y0 + (y1 - y0) * t).any())
+
+# A track described by resources/track/N/track.json. Its texture mipmaps, collision
+# bits and minimap are preprocessed on first use into .npy files next to the source images,
+# later races only memory map them. pack.json records the mtime and hash of every
+# source, a source is only hashed again when its mtime changed
+class Track:
+
+    size = (1024, 1024)
+    minimap_size = (200, 200)
+    sources = {"texture": "track.png", "mask": "mask.png", "minimap": "minimap.png"}
+    arrays = ("mipmaps", "palette", "palette_mipmaps", "collision", "minimap")
+
+    # The texture and its halvings down to 16x16, flattened one after the other into
+    # one array of RGB texels. A texel of level l is at offsets[l] + x * (1024 >> l) + y.
+    # palette_mipmaps holds the same texels as indices into a palette of 256 colours
+    mip_levels = 7
+    offsets = np.cumsum([0] + [(1024 >> level) ** 2 for level in range(mip_levels - 1)])
+
+    def __init__(self, number, folder, meta):
+        self.number = number
+        self.folder = folder
+        self.name = meta.get("name", f"Track {number}")
+        self.start = tuple(meta["start"])
+        self.finish_line = tuple(tuple(point) for point in meta["finish_line"])
+        self.files = {name: os.path.join(folder, meta.get(name, default)) for name, default in self.sources.items()}
+        self.manifest_path = os.path.join(folder, "pack.json")
+        self.pack = None
+
+    # Texture mipmaps, collision bits and minimap of the track, mapped from disk or freshly built
+    def load(self):
+        if self.pack is None:
+            if self.stale():
+                arrays = self.build()
+                try:
+                    self.save(arrays)
+                except OSError as e:
+                    print(f"Could not save track {self.number}: {e}")
+                    self.pack = arrays
+                    return self.pack
+            self.pack = {name: np.load(self.array_path(name), mmap_mode="r") for name in self.arrays}
+        return self.pack
+
+    def array_path(self, name):
+        return os.path.join(self.folder, f"{name}.npy")
+
+    @staticmethod
+    def file_hash(path):
+        digest = hashlib.sha1()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def stale(self):
+        try:
+            with open(self.manifest_path) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return True
+        if not all(os.path.exists(self.array_path(name)) for name in self.arrays):
+            return True
+
+        touched = False
+        for name, path in self.files.items():
+            entry = manifest.get(name)
+            if entry is None or entry["path"] != path or not os.path.exists(path):
+                return True
+            mtime = os.path.getmtime(path)
+            if entry["mtime"] != mtime:
+                if entry["sha1"] != self.file_hash(path):
+                    return True
+                entry["mtime"] = mtime
+                touched = True
+
+        # only the mtime changed, remember it so the file is not hashed on every race
+        if touched:
+            try:
+                self.write_manifest(manifest)
+            except OSError:
+                pass
+        return False
+
+    def build(self):
+        texture = pg.surfarray.array3d(pg.transform.scale(pg.image.load(self.files["texture"]), self.size))
+        mask = pg.surfarray.array2d(pg.transform.scale(pg.image.load(self.files["mask"]), self.size))
+        minimap = pg.surfarray.array3d(pg.transform.scale(pg.image.load(self.files["minimap"]), self.minimap_size))
+        levels = self.mip_pyramid(texture)
+        palette, indices = self.quantize(levels)
+        return {
+            "mipmaps": np.concatenate([level.reshape(-1, 3) for level in levels]),
+            "palette": palette,
+            "palette_mipmaps": np.concatenate([level.reshape(-1, 1) for level in indices]),
+            "collision": np.packbits(mask != 0, axis=1),
+            "minimap": np.ascontiguousarray(minimap),
+        }
+
+    # Each level averages 2x2 texels of the one above it
+    def mip_pyramid(self, texture):
+        level = texture.astype(np.uint16)
+        levels = [level]
+        for _ in range(self.mip_levels - 1):
+            level = (level[0::2, 0::2] + level[1::2, 0::2] + level[0::2, 1::2] + level[1::2, 1::2] + 2) // 4
+            levels.append(level)
+        return [level.astype(np.uint8) for level in levels]
+
+    # 256 colour palette of the full texture, every level is mapped to its nearest colours
+    def quantize(self, levels):
+        base = Image.fromarray(levels[0]).quantize(256, dither=0)
+        palette = np.array(base.getpalette()[: 256 * 3], dtype=np.uint8).reshape(-1, 3)
+        palette = np.vstack((palette, np.zeros((256 - len(palette), 3), dtype=np.uint8)))
+        indices = [np.asarray(base)] + [np.asarray(Image.fromarray(level).quantize(palette=base, dither=0)) for level in levels[1:]]
+        return palette, indices
+
+    # Every file is written next to its target and renamed, the manifest goes last
+    # so an interrupted save is rebuilt on the next race
+    def save(self, arrays):
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        for name in self.arrays:
+            path = self.array_path(name)
+            with open(path + ".tmp", "wb") as file:
+                np.save(file, arrays[name])
+            os.replace(path + ".tmp", path)
+        manifest = {
+            name: {"path": path, "mtime": os.path.getmtime(path), "sha1": self.file_hash(path)}
+            for name, path in self.files.items()
+        }
+        self.write_manifest(manifest)
+
+    def write_manifest(self, manifest):
+        with open(self.manifest_path + ".tmp", "w") as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+# Every track with a track.json in the track folder, only the metadata is read here
+class TrackRegistry:
+
+    def __init__(self, root="resources/track"):
+        self.tracks = {}
+        for name in sorted(os.listdir(root), key=lambda name: (len(name), name)):
+            folder = os.path.join(root, name)
+            if name.isdigit() and os.path.exists(os.path.join(folder, "track.json")):
+                with open(os.path.join(folder, "track.json")) as file:
+                    self.tracks[int(name)] = Track(int(name), folder, json.load(file))
+
+    def __getitem__(self, number):
+        return self.tracks[number]
+
+    def __iter__(self):
+        return iter(self.tracks.values())
+
+# Lap times of every track in a SQLite database, one row per lap numbered per track.
+# Every lap is written in its own transaction, so a crash never leaves a half
+# written file. The (track, time) index answers best lap, percentiles and sorted
+# pages without reading the other laps
+class RecordStore:
+
+    def __init__(self, path="race_records.db", legacy_path="race_records.json"):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS laps (track INTEGER, lap INTEGER, time REAL, PRIMARY KEY (track, lap))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS laps_by_time ON laps (track, time, lap)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.migrate(legacy_path)
+
+    # Import the laps of the old JSON file once, together with the flag that says so
+    def migrate(self, legacy_path):
+        if legacy_path is None or self.connection.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+            return
+        try:
+            with open(legacy_path, "r") as file:
+                records = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            records = {}
+        with self.connection:
+            for track, times in records.items():
+                for lap, time_taken in enumerate(times, start=self.count(int(track)) + 1):
+                    self.connection.execute("INSERT INTO laps VALUES (?, ?, ?)", (int(track), lap, time_taken))
+            self.connection.execute("INSERT INTO meta VALUES ('migrated', ?)", (legacy_path,))
+
+    # Append a lap and return its number on the track
+    def add(self, track, time_taken):
+        with self.connection:
+            lap = self.count(track) + 1
+            self.connection.execute("INSERT INTO laps VALUES (?, ?, ?)", (track, lap, time_taken))
+        return lap
+
+    def count(self, track):
+        return self.connection.execute("SELECT COUNT(*) FROM laps WHERE track = ?", (track,)).fetchone()[0]
+
+    def best(self, track):
+        return self.connection.execute("SELECT MIN(time) FROM laps WHERE track = ?", (track,)).fetchone()[0]
+
+    # Lap time below which q percent of the laps of the track are, None without laps
+    def percentile(self, track, q):
+        count = self.count(track)
+        if not count:
+            return None
+        offset = min(count - 1, int(q / 100 * count))
+        return self.connection.execute(
+            "SELECT time FROM laps WHERE track = ? ORDER BY time LIMIT 1 OFFSET ?", (track, offset)
+        ).fetchone()[0]
+
+    # (lap, time) pairs of a track in the order they were played or by time
+    def laps(self, track, sort=False, offset=0, limit=-1):
+        order = "time, lap" if sort else "lap"
+        return self.connection.execute(
+            f"SELECT lap, time FROM laps WHERE track = ? ORDER BY {order} LIMIT ? OFFSET ?", (track, limit, offset)
+        ).fetchall()
+
+# Treeview of the laps of one track that only holds the pages scrolled to. Each order
+# keeps its own loaded prefix of laps, the table shows the prefix of the current order
+# and the rows of the other order are detached, not deleted, so switching the order
+# moves rows instead of inserting them again
+class RecordView:
+
+    page = 200
+
+    def __init__(self, table, store, track):
+        self.table = table
+        self.store = store
+        self.track = track
+        self.sort = False
+        self.loaded = {False: [], True: []}
+        self.times = {}
+        self.count = 0
+        self.loading = False
+        table.configure(yscrollcommand=self.on_scroll)
+
+    # Position of a lap in an order, the lap number always comes last
+    @staticmethod
+    def key(sort, lap, time_taken):
+        return (time_taken, lap) if sort else (lap,)
+
+    # Show the row of a lap at index, the row is made the first time
+    def place(self, lap, index):
+        if self.table.exists(str(lap)):
+            self.table.move(str(lap), '', index)
+        else:
+            self.table.insert('', index, iid=str(lap), values=(lap, f"{self.times[lap]:.2f}"))
+
+    # Next page of laps in the current order
+    def load_page(self):
+        loaded = self.loaded[self.sort]
+        for lap, time_taken in self.store.laps(self.track, self.sort, len(loaded), self.page):
+            self.times[lap] = time_taken
+            loaded.append(self.key(self.sort, lap, time_taken))
+            self.place(lap, len(loaded) - 1)
+        self.loading = False
+
+    # Fetch the next page once the last rows come into view
+    def on_scroll(self, first, last):
+        if float(last) > 0.9 and len(self.loaded[self.sort]) < self.count and not self.loading:
+            self.loading = True
+            self.table.after_idle(self.load_page)
+
+    def set_sort(self, sort):
+        if sort == self.sort:
+            return
+        self.sort = sort
+        loaded = self.loaded[sort]
+        for index, key in enumerate(loaded):
+            self.place(key[-1], index)
+        self.table.detach(*self.table.get_children()[len(loaded):])
+        if not loaded:
+            if not self.times:
+                self.count = self.store.count(self.track)
+            self.load_page()
+
+    # Fill the first page, later add the laps played since the last refresh to every
+    # order whose prefix they fall in. Laps past an incomplete prefix come with its pages
+    def refresh(self):
+        count = self.store.count(self.track)
+        if not self.loaded[self.sort]:
+            self.count = count
+            self.load_page()
+            return
+        for lap, time_taken in self.store.laps(self.track, False, self.count):
+            self.times[lap] = time_taken
+            for sort, loaded in self.loaded.items():
+                key = self.key(sort, lap, time_taken)
+                index = bisect.bisect_left(loaded, key)
+                if index < len(loaded) and loaded[index] == key:
+                    continue
+                if loaded and (index < len(loaded) or len(loaded) >= self.count):
+                    loaded.insert(index, key)
+                    if sort == self.sort:
+                        self.place(lap, index)
+        self.count = count
+
+# Text of the HUD, every font is loaded once, static strings are rendered once
+# and changing strings are put together from cached glyphs
+class HudText:
+
+    def __init__(self, name="Terminal"):
+        self.name = name
+        self.fonts = {}
+        self.texts = {}
+        self.glyphs = {}
+
+    def font(self, size):
+        if size not in self.fonts:
+            self.fonts[size] = pg.font.SysFont(self.name, size)
+        return self.fonts[size]
+
+    # Surface of a string that never changes, like a label or a warning
+    def render(self, text, size, color):
+        key = (text, size, color)
+        if key not in self.texts:
+            self.texts[key] = self.font(size).render(text, True, color)
+        return self.texts[key]
+
+    def glyph(self, char, size, color):
+        key = (char, size, color)
+        if key not in self.glyphs:
+            self.glyphs[key] = self.font(size).render(char, True, color)
+        return self.glyphs[key]
+
+    # Draw a string that changes every frame, like the timer, glyph by glyph
+    def draw(self, screen, text, size, color, **position):
+        glyphs = [self.glyph(char, size, color) for char in text]
+        rect = pg.Rect(0, 0, sum(g.get_width() for g in glyphs), self.font(size).get_height())
+        for name, value in position.items():
+            setattr(rect, name, value)
+
+        x = rect.x
+        for g in glyphs:
+            screen.blit(g, (x, rect.y))
+            x += g.get_width()
+        return rect
+
+# Times every stage of the game loop, the last frames are kept in a fixed size
+# ring buffer. Stages are wrapped only when the profiler is attached, so the
+# game loop runs untouched when profiling is off
+class Profiler:
+
+    # once per frame each, the physics ticks and their finish line test are inside movement
+    stages = (
+        "check_events", "surface", "car", "movement",
+        "gauge", "timer", "minimap", "update_display",
+    )
+    colors = ("gray", "blue", "green", "yellow", "orange", "magenta", "purple", "red")
+
+    def __init__(self, size=600):
+        self.durations = np.zeros([size, len(self.stages)], dtype=np.int64)
+        self.starts = np.zeros([size, len(self.stages)], dtype=np.int64)
+        self.frame = 0
+
+    # Replace the stages of the game with timed versions
+    def attach(self, game):
+        for column, name in enumerate(self.stages):
+            setattr(game, name, self.timed(column, getattr(game, name)))
+
+    def timed(self, column, stage):
+        last = column == len(self.stages) - 1
+
+        def run_stage(*args):
+            start = time.perf_counter_ns()
+            result = stage(*args)
+            row = self.frame % len(self.durations)
+            self.starts[row, column] = start
+            self.durations[row, column] = time.perf_counter_ns() - start
+            if last:
+                self.frame += 1
+            return result
+
+        return run_stage
+
+    # Durations of the frames recorded so far, oldest first
+    def recorded(self, durations):
+        size = len(durations)
+        if self.frame <= size:
+            return durations[: self.frame]
+        return np.roll(durations, -(self.frame % size), axis=0)
+
+    # Percentile of every stage in milliseconds
+    def percentile(self, q):
+        durations = self.recorded(self.durations)
+        if not len(durations):
+            return np.zeros(len(self.stages))
+        return np.percentile(durations, q, axis=0) / 1e6
+
+    # Stacked bar of the median stage times with a legend, 20 pixels per millisecond
+    def draw(self, screen, hud, x, y):
+        median, p95 = self.percentile(50), self.percentile(95)
+        # one stacked bar of the median frame, the legend below it
+        left, line = x, y + 18
+        for name, color, ms, slow in zip(self.stages, self.colors, median, p95):
+            width = int(ms * 20)
+            pg.draw.rect(screen, color, (left, y, width, 15))
+            left += width
+            hud.draw(screen, f"{name} {ms:.2f} / {slow:.2f} ms", 15, color, topleft=(x, line))
+            line += 18
+
+    # Write the recorded frames as a Chrome trace (json) or a csv file
+    def export(self, path):
+        starts, durations = self.recorded(self.starts), self.recorded(self.durations)
+        origin = starts[starts > 0].min() if starts.any() else 0
+        with open(path, "w") as file:
+            if path.endswith(".csv"):
+                file.write("frame,stage,start_us,duration_us\n")
+                for frame, (row_starts, row_durations) in enumerate(zip(starts, durations)):
+                    for name, start, duration in zip(self.stages, row_starts, row_durations):
+                        file.write(f"{frame},{name},{(start - origin) / 1000},{duration / 1000}\n")
+            else:
+                events = [
+                    {"name": name, "ph": "X", "pid": 0, "tid": 0,
+                     "ts": (start - origin) / 1000, "dur": duration / 1000}
+                    for row_starts, row_durations in zip(starts, durations)
+                    for name, start, duration in zip(self.stages, row_starts, row_durations)
+                ]
+                json.dump({"traceEvents": events}, file)
+
+# Least recently used assets up to a fixed count, built on a miss
+class AssetCache:
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+
+    def get(self, key, build):
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+        item = self.items[key] = build()
+        while len(self.items) > self.size:
+            self.items.popitem(last=False)
+        return item
+
+# Everything that outlives a race. pygame and the mixer are set up once and decoded
+# tracks, sounds and sprites stay in an LRU cache, so the next race starts warm
+class Session:
+
+    def __init__(self, cache_size=16, records=None):
         pg.init()
         pg.mixer.init()
-        
+        self.tracks = TrackRegistry()
+        self.records = records or RecordStore()
+        self.hud = HudText()
+        self.assets = AssetCache(cache_size)
+
+    def sound(self, path):
+        return self.assets.get(("sound", path), lambda: pg.mixer.Sound(path))
+
+# class consists of game elements, load resources, UI, and handling car
+class Game:
+
+    def __init__(self, session=None):
+        self.session = session or Session()
+        self.load_settings()
+
         # Set screen
-        self.screen = pg.display.set_mode()
-        self.width, self.height = map(int, self.resolution.get().split('x'))
+        self.width, self.height = self.config.width, self.config.height
+        self.screen = self.create_screen()
 
         self.running = True
         self.first_crossing = True
 
-        # Variable for render ray tracing
-        self.hres = 120
-        self.halfvres = self.height // 2  
-        self.mod = self.hres / 60
+        # Variable for render ray tracing, the resolution is lowered from
+        # there when dynamic resolution cannot hold the frame rate
+        self.base_hres = self.config.hres
+        self.base_halfvres = self.height // 2
+        self.render_scale = 1
+        self.frame_ms = 0
+        self.pace_cooldown = 0
 
         # variable for car
         self.acceleration = 0
         self.rot_over_time = 0
 
-        # clock
+        # clock, the physics runs in fixed ticks and the renderer draws in between them
         self.clock = pg.time.Clock()
-        self.start_ticks = pg.time.get_ticks()
-        self.show_fps = show_fps
+        self.ticks = 0
+        self.accumulator = 0
+        self.off_track = False
+
+        self.hud = self.session.hud
+        self.tracks = self.session.tracks
+        self.records = self.session.records
+
+        # needle end points of the speedometer for every quarter of a degree
+        angles = np.radians(140 + np.arange(0, 271 * 4) / 4)
+        self.needle = np.stack((100 * np.cos(angles), 100 * np.sin(angles)), axis=1).tolist()
+
+    # A vsync display has to be the size of the view, scaled up to fill the desktop,
+    # otherwise use the whole desktop. The display is closed after every race, the
+    # rest of pygame stays up
+    def create_screen(self):
+        pg.display.init()
+        if self.config.vsync:
+            try:
+                return pg.display.set_mode((self.width, self.height), pg.SCALED | pg.FULLSCREEN, vsync=1)
+            except pg.error as e:
+                print(f"VSync is not available: {e}")
+        return pg.display.set_mode()
+
+    # Take a snapshot of the settings for the race
+    def load_settings(self):
+        self.config = GameConfig.from_settings(read_settings())
 
-    # Initialize starting point and finish line of each track
+    # Starting point and finish line of the selected track
     def track_selection(self):
-
-        t = self.track.get()
-        if t == 1:
-            self.posx, self.posy, self.rot = 19.7, 18.15, 4.73
-            self.finish_line_start = (18.5, 16)
-            self.finish_line_end = (21, 17)
-        elif t == 2:
-            self.posx, self.posy, self.rot = 25.9, 21.14, 4.73
-            self.finish_line_start = (24.94, 19.5)
-            self.finish_line_end = (27, 18.7)
-        elif t == 2:
-            self.posx, self.posy, self.rot = 25.9, 21.14, 4.73
-            self.finish_line_start = (24.94, 19.5)
-            self.finish_line_end = (27, 18.7)
-        elif t == 3:
-            self.posx, self.posy, self.rot = 27.11, 17.37, 4.9
-            self.finish_line_start = (28.33, 15.61)
-            self.finish_line_end = (26.54, 15.33)
-        elif t == 4:
-            self.posx, self.posy, self.rot = 27.31, 17.56, 4.74
-            self.finish_line_start = (28.95, 15)
-            self.finish_line_end = (26.38, 15.54)
-        elif t == 5:
-            self.posx, self.posy, self.rot = 25.58, 17.4, 4.74
-            self.finish_line_start = (24.68, 15.08)
-            self.finish_line_end = (26.45, 15.3)
-        elif t == 6:
-            self.posx, self.posy, self.rot = 11.21, 15.47, 0.013
-            self.finish_line_start = (13.24, 14.75)
-            self.finish_line_end = (13.43, 16.23)
-        self.prev_posx, self.prev_posy = self.posx, self.posy
+        self.track = self.tracks[self.config.track]
+        self.posx, self.posy, self.rot = self.track.start
+        self.finish_line_start, self.finish_line_end = self.track.finish_line
+        self.prev_posx, self.prev_posy, self.prev_rot = self.posx, self.posy, self.rot
+        self.viewx, self.viewy, self.view_rot = self.posx, self.posy, self.rot
 
     def run(self):
 
         self.load_settings()
+        self.tick_time = 1 / self.config.tick_rate
+        # the car was tuned at 60 ticks a second, every change per tick is scaled by
+        # this so the car drives the same at any tick rate
+        self.tick_scale = 60 * self.tick_time
+        self.select_renderer()
         self.track_selection()
         self.load_resources()
+        self.set_resolution(self.base_hres, self.base_halfvres)
         self.start_sound.play()
 
+        self.profiler = None
+        if self.config.profiler:
+            self.profiler = Profiler()
+            self.profiler.attach(self)
+
         while self.running:
-            pressed_keys = pg.key.get_pressed()
+            pressed_keys = self.read_keys()
             self.check_events()
             self.surface()
-            self.check_finish_line()
             self.car()
             self.movement(pressed_keys)
             self.gauge(self.width - 200, self.height - 150)
             self.timer()
             self.minimap()
-            if self.show_fps.get():
+            if self.config.show_fps:
                 self.display_fps()
-            pg.display.update()
+            if self.profiler:
+                self.profiler.draw(self.screen, self.hud, 10, 50)
+            self.update_display()
+            if self.config.dynamic_resolution:
+                self.pace_resolution()
+
+        if self.profiler:
+            self.export_profile()
+        if self.workers:
+            self.workers.shutdown()
+
+        # hand the screen back to the menu, the cached assets stay for the next race
+        pg.mixer.stop()
+        pg.display.quit()
+
+    # Allocate the frame buffer and the surfaces it is presented through, once per resolution
+    def create_frame_buffers(self):
+        self.frame = np.zeros([self.hres, self.halfvres * 2, 3], dtype=np.uint8)
+        self.frame_surface = pg.Surface((self.hres, self.halfvres * 2), 0, self.screen)
+
+        # scale straight into the screen when the view fits in it
+        view_rect = pg.Rect(0, 0, self.width, self.height)
+        if self.screen.get_rect().contains(view_rect):
+            self.view_surface = self.screen.subsurface(view_rect)
+        else:
+            self.view_surface = pg.Surface(view_rect.size, 0, self.screen)
+
+    # Resample the skybox once to one column per degree of heading, in the frame layout
+    def prepare_sky(self):
+        if self.halfvres not in self.sky_strips:
+            sky = pg.surfarray.array3d(
+                pg.transform.scale(self.sky, (360, self.halfvres * 1.5))
+            )
+            self.sky_strips[self.halfvres] = np.ascontiguousarray(sky[:, : self.halfvres])
+        self.sky_strip = self.sky_strips[self.halfvres]
+
+    # Pick the floorcast backend from settings, numpy is used when numba is missing
+    def select_renderer(self):
+        self.render_backend = self.config.renderer
+        if self.render_backend == "numba" and numba is None:
+            print("Numba is not installed. Using numpy renderer.")
+            self.render_backend = "numpy"
+
+        # split the screen columns in one tile per worker thread
+        threads = max(1, self.config.render_threads)
+        self.workers = None
+        if self.render_backend == "numba":
+            numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+        elif threads > 1:
+            self.workers = ThreadPoolExecutor(threads)
+        self.smooth_sky = self.config.sky_interpolation
+        self.thread_count = threads
+
+    # Change the floorcast resolution, ray tables and sky strips come from their caches
+    def set_resolution(self, hres, halfvres, cache_dir="cache/rays"):
+        self.hres, self.halfvres = hres, halfvres
+        self.mod = self.hres / 60
+        self.rays = RayTables.get(self.hres, self.halfvres * 2, cache_dir=cache_dir)
+        self.row_levels = self.mip_levels(self.rays.footprint)
+        self.prepare_shading()
+        self.create_frame_buffers()
+        self.prepare_sky()
+        bounds = np.linspace(0, self.hres, self.thread_count + 1).astype("int")
+        self.tiles = list(zip(bounds[:-1], bounds[1:]))
+
+    # Integer shading of the floor. Rows are darkened by a multiply with the shade in
+    # 1/256 steps and a shift, in palette mode every row gets its own darkened palette
+    def prepare_shading(self):
+        self.shade = np.round(self.rays.shade * 256).astype(np.uint16)
+        self.palette_rows = np.arange(self.halfvres) * 256
+        if self.palette is None:
+            self.shaded_palette = np.zeros((1, 3), dtype=np.uint8)
+        else:
+            shaded = self.rays.shade[0][:, None, :] * self.palette[None, :, :]
+            self.shaded_palette = shaded.astype(np.uint8).reshape(-1, 3)
+
+    # Mip level of every floor row, the level whose texels are about one pixel
+    # wide, near rows keep the full texture
+    def mip_levels(self, footprint):
+        if not self.config.mipmaps:
+            return np.zeros(len(footprint), dtype=np.int64)
+        levels = np.floor(np.log2(np.maximum(footprint, 1)))
+        return np.clip(levels, 0, Track.mip_levels - 1).astype(np.int64)
+
+    # Lower or raise the floorcast resolution to hold the target frame time. The
+    # gap between the two thresholds and the cooldown keep it from flickering
+    def pace_resolution(self):
+        self.frame_ms = self.frame_ms * 0.9 + self.clock.get_rawtime() * 0.1
+        self.pace_cooldown -= 1
+        if self.pace_cooldown > 0:
+            return
+
+        target = 1000 / (self.config.fps_cap or 60)
+        if self.frame_ms > target * 0.95 and self.render_scale > 0.25:
+            self.render_scale = max(0.25, self.render_scale * 0.8)
+        elif self.frame_ms < target * 0.6 and self.render_scale < 1:
+            self.render_scale = min(1, self.render_scale / 0.8)
+        else:
+            return
+        self.pace_cooldown = 30
+        self.set_resolution(
+            max(8, int(self.base_hres * self.render_scale)),
+            max(8, int(self.base_halfvres * self.render_scale)),
+            cache_dir=None,  # no disk writes in the middle of a race
+        )
 
-        pg.quit()
+    def update_display(self):
+        pg.display.update()
+
+    # Dump the profile of the race in the format chosen in settings
+    def export_profile(self):
+        extension = {"chrome": "json", "csv": "csv"}.get(self.config.profile_export)
+        if extension:
+            os.makedirs("profiles", exist_ok=True)
+            self.profiler.export(f"profiles/track{self.config.track}_{time.strftime('%Y%m%d_%H%M%S')}.{extension}")
+
+    # State of the keyboard for this frame
+    def read_keys(self):
+        return pg.key.get_pressed()
 
     def display_fps(self):
         fps = self.clock.get_fps()
-        font = pg.font.SysFont("Terminal", 30)
-        fps_text = font.render(f"FPS: {int(fps)}", True, pg.Color('white'))
-        self.screen.blit(fps_text, (10, 10))
+        self.hud.draw(self.screen, f"FPS: {int(fps)}", 30, "white", topleft=(10, 10))
+
+    # Scale the nine car frames once, side by side on one surface in the display format
+    def create_car_atlas(self, size):
+        w, h = size
+        car_atlas = pg.Surface((w * 9, h), pg.SRCALPHA).convert_alpha()
+        car_frames = {}
+        for i in range(1, 10):
+            car_frames[i] = pg.Rect((i - 1) * w, 0, w, h)
+            image = pg.image.load(f"resources/car/frame_{i:02d}.png").convert_alpha()
+            # scale straight into the atlas so the pixels are copied, not blended
+            pg.transform.scale(image, size, car_atlas.subsurface(car_frames[i]))
+        return car_atlas, car_frames
 
     def car(self):
         offset = 1.5
         frame_index = min(max(int(self.rot_over_time / (0.03 * offset) * 4 + 5), 1), 9)
-        car = self.car_images[frame_index]
-        car = pg.transform.scale(car, (500, 500))
-        self.screen.blit(car, (self.width / 2 - 250, self.height / 2 + 75))
+        self.screen.blit(
+            self.car_atlas, (self.width / 2 - 250, self.height / 2 + 75), self.car_frames[frame_index]
+        )
     
     def update_rotation(self, pressed_keys):
-        left_pressed = (
-            pressed_keys[pg.K_LEFT]
-            or pressed_keys[ord(f"{self.left_key.get()}".lower())]
-        )
-        right_pressed = (
-            pressed_keys[pg.K_RIGHT]
-            or pressed_keys[ord(f"{self.right_key.get()}".lower())]
-        )
+        config = self.config
+        left_pressed = pressed_keys[pg.K_LEFT] or pressed_keys[config.left_key]
+        right_pressed = pressed_keys[pg.K_RIGHT] or pressed_keys[config.right_key]
 
-        value = 0.003 * self.steering.get() / 5
+        value = config.steering * self.tick_scale
 
         if left_pressed and self.rot_over_time > -0.1:
             self.rot_over_time -= value
@@ -166,41 +1068,36 @@ class Game(Main):
             self.rot_over_time += value
 
         if abs(self.rot_over_time) > 0.01:
-            self.rot_over_time -= 0.001 * np.sign(self.rot_over_time)
+            self.rot_over_time -= 0.001 * self.tick_scale * np.sign(self.rot_over_time)
         elif not left_pressed and not right_pressed:
             self.rot_over_time = 0
 
         if (left_pressed or right_pressed) and abs(self.acceleration) > 2:
             if not self.tire_screech_sound.get_num_channels():
-                self.tire_screech_sound.set_volume(self.tire_sound.get())
+                self.tire_screech_sound.set_volume(config.tire_volume)
                 self.tire_screech_sound.play()
 
     def update_acceleration(self, pressed_keys):
-        forward_pressed = (
-            pressed_keys[pg.K_UP]
-            or pressed_keys[ord(f"{self.forward_key.get()}".lower())]
-        )
-        backward_pressed = (
-            pressed_keys[pg.K_DOWN]
-            or pressed_keys[ord(f"{self.backward_key.get()}".lower())]
-        )
+        config = self.config
+        forward_pressed = pressed_keys[pg.K_UP] or pressed_keys[config.forward_key]
+        backward_pressed = pressed_keys[pg.K_DOWN] or pressed_keys[config.backward_key]
 
         if forward_pressed and self.acceleration <= 3:
-            self.acceleration += 0.01
+            self.acceleration += 0.01 * self.tick_scale
         elif backward_pressed and self.acceleration >= -3:
-            self.acceleration -= 0.01
+            self.acceleration -= 0.01 * self.tick_scale
         elif (
             not forward_pressed
             and not backward_pressed
             and abs(self.acceleration) > 0.001
         ):
-            self.acceleration -= 0.005 * np.sign(self.acceleration)
+            self.acceleration -= 0.005 * self.tick_scale * np.sign(self.acceleration)
         elif -3 <= self.acceleration >= 3:
             self.acceleration == self.acceleration
         else:
             self.acceleration = 0
 
-        self.eng_sound.set_volume( self.engine_sound.get() / 10 * self.master_sound.get() / 10 * int(abs(self.acceleration) + 1) )
+        self.eng_sound.set_volume(config.engine_volume * int(abs(self.acceleration) + 1))
         if abs(self.acceleration) > 0.01:
             if not self.eng_sound.get_num_channels():
                 self.eng_sound.play()
@@ -220,18 +1117,38 @@ class Game(Main):
 
     # Check track border by using mask picture of track
     def check_track_border(self):
-        if self.track_border[int(self.posx * 34.13)][int(self.posy * 34.13)] != 0:
-            self.acceleration -= 0.001
-            fontt = pg.font.SysFont("Terminal", 50)
-            text = fontt.render("Do not cross the track", True, "red")
-            textRect = text.get_rect()
-            textRect.center = (self.width // 2, self.height // 5)
-            self.screen.blit(text, textRect)
-
-    # handling movement of the car
+        self.off_track = self.collision.swept(self.prev_posx, self.prev_posy, self.posx, self.posy)
+        if self.off_track:
+            self.acceleration -= 0.001 * self.tick_scale
+
+    def track_warning(self):
+        text = self.hud.render("Do not cross the track", 50, "red")
+        textRect = text.get_rect()
+        textRect.center = (self.width // 2, self.height // 5)
+        self.screen.blit(text, textRect)
+
+    # handling movement of the car, runs as many fixed physics ticks as the frame took
     def movement(self, pressed_keys):
-        self.prev_posx, self.prev_posy = self.posx, self.posy
-        et = self.clock.tick() / 500
+        # a very slow frame is cut short instead of running many ticks to catch up
+        self.accumulator += min(self.clock.tick(self.config.fps_cap) / 1000, 0.25)
+        while self.accumulator >= self.tick_time and self.running:
+            self.physics_tick(pressed_keys)
+            self.accumulator -= self.tick_time
+
+        # the renderer shows the car between the last two ticks
+        alpha = self.accumulator / self.tick_time
+        turn = (self.rot - self.prev_rot + np.pi) % (np.pi * 2) - np.pi
+        self.viewx = self.prev_posx + (self.posx - self.prev_posx) * alpha
+        self.viewy = self.prev_posy + (self.posy - self.prev_posy) * alpha
+        self.view_rot = (self.prev_rot + turn * alpha) % (np.pi * 2)
+
+        if self.off_track:
+            self.track_warning()
+
+    # One step of the simulation, always the same length whatever the frame rate
+    def physics_tick(self, pressed_keys):
+        self.prev_posx, self.prev_posy, self.prev_rot = self.posx, self.posy, self.rot
+        et = self.tick_time * 1000 / 500
 
         self.update_rotation(pressed_keys)
         self.update_acceleration(pressed_keys)
@@ -240,22 +1157,46 @@ class Game(Main):
         self.limit_race_area(new_x, new_y)
         self.check_track_border()
 
-        self.rot += self.rot_over_time * self.acceleration
+        self.rot += self.rot_over_time * self.acceleration * self.tick_scale
         self.rot = self.rot % (np.pi * 2)
 
+        self.ticks += 1
+        self.check_finish_line()
+
+    # Race time counted in physics ticks, so it does not depend on the frame rate
+    def race_time(self):
+        return round(self.ticks * self.tick_time, 3)
+
     #  load all resources pictures and sound file
     def load_resources(self):
-        size = (1024, 1024)
-        self.track_border = pg.surfarray.array2d(pg.transform.scale(pg.image.load(f"resources/track/{self.track.get()}/mask.png"), size))
-        self.map = pg.surfarray.array3d(pg.transform.scale(pg.image.load(f"resources/track/{self.track.get()}/track.png"), size))
-        
-        self.sky = pg.image.load(r"resources\env\skybox.jpg")
+        assets = self.session.assets
+        self.collision, self.mipmaps, self.palette, self.minimap_image = assets.get(
+            ("track", self.track.number, self.config.palette_mode), self.load_track
+        )
+
+        # recent positions of the car for the minimap, kept in a fixed size ring buffer
+        self.trail = np.zeros([self.config.minimap_trail, 2])
+        self.trail_index = 0
+        self.trail_count = 0
 
-        self.car_images = { i: pg.image.load((f"resources/car/frame_{i:02d}.png")) for i in range(1, 10) }
+        self.sky = assets.get("sky", lambda: pg.image.load("resources/env/skybox.jpg"))
+        self.sky_strips = assets.get("sky_strips", dict)
 
-        self.start_sound = pg.mixer.Sound(r"resources\sound\start_engine.mp3")
-        self.tire_screech_sound = pg.mixer.Sound(r"resources\sound\tire.mp3")
-        self.eng_sound = pg.mixer.Sound(r"resources\sound\acc_sound.mp3")
+        self.car_atlas, self.car_frames = assets.get(("car", (500, 500)), lambda: self.create_car_atlas((500, 500)))
+
+        self.start_sound = self.session.sound("resources/sound/start_engine.mp3")
+        self.tire_screech_sound = self.session.sound("resources/sound/tire.mp3")
+        self.eng_sound = self.session.sound("resources/sound/acc_sound.mp3")
+
+    # Collision grid, texture and minimap of the selected track
+    def load_track(self):
+        pack = self.track.load()
+        if self.config.palette_mode:
+            mipmaps, palette = pack["palette_mipmaps"], pack["palette"]
+        else:
+            mipmaps, palette = pack["mipmaps"], None
+        minimap_image = pg.surfarray.make_surface(pack["minimap"]).convert()
+        return CollisionGrid(pack["collision"]), mipmaps, palette, minimap_image
 
     #  Check if coordinate of the car is intersect with finish line
     def check_finish_line(self):
@@ -295,20 +1236,7 @@ class Game(Main):
 
     # Save record after finish the game
     def save_record(self):
-        time_taken = (pg.time.get_ticks() - self.start_ticks) / 1000
-        track_number = self.track.get()
-        record = time_taken
-
-        try:
-            with open("race_records.json", "r") as file:
-                records = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            records = {str(i): [] for i in range(1, 7)}  # Assuming there are 3 tracks
-
-        records[str(track_number)].append(record)
-
-        with open("race_records.json", "w") as file:
-            json.dump(records, file, indent=4)
+        self.records.add(self.config.track, self.race_time())
 
     # check button to exit the game
     def check_events(self):
@@ -320,135 +1248,232 @@ class Game(Main):
             ):
                 self.running = False
 
-    def gauge(self, x, y):
-        col = (255, 0, 0)
-        s = abs(self.acceleration / 3 * 260)
+    # Draw the ticks and numerals of the speedometer once, centered on their own surface
+    def create_dial(self):
+        r = 120
+        dial = pg.Surface((r * 2, r * 2), pg.SRCALPHA)
         for i in range(0, 29):
             xcos = np.cos(np.radians(140 + i * 9.28))
             ysin = np.sin(np.radians(140 + i * 9.28))
             pg.draw.line(
-                self.screen,
+                dial,
                 "white",
                 (
-                    x + (105 if i % 2 == 0 else 110) * xcos,
-                    y + (105 if i % 2 == 0 else 110) * ysin,
+                    r + (105 if i % 2 == 0 else 110) * xcos,
+                    r + (105 if i % 2 == 0 else 110) * ysin,
                 ),
                 (
-                    x + 115 * xcos,
-                    y + 115 * ysin,
+                    r + 115 * xcos,
+                    r + 115 * ysin,
                 ),
                 2,
             )
             if i % 2 == 0:
-                num = pg.font.SysFont("Terminal", 20)
-                km = num.render(f"{i*10}", True, "white")
+                km = self.hud.render(f"{i*10}", 20, "white")
                 trkm = km.get_rect()
                 trkm.center = (
-                    x + 90 * xcos,
-                    y + 90 * ysin,
+                    r + 90 * xcos,
+                    r + 90 * ysin,
                 )
-                self.screen.blit(km, trkm)
-        pg.draw.line(
-            self.screen,
-            "red",
-            (x, y),
-            (
-                x + 100 * np.cos(np.radians(140 + s)),
-                y + 100 * np.sin(np.radians(140 + s)),
-            ),
-            5,
-        )
+                dial.blit(km, trkm)
+        return dial.convert_alpha()
+
+    # Blit the dial, cached per resolution for the whole session, and draw only the needle
+    def gauge(self, x, y):
+        dial = self.session.assets.get(("dial", self.width, self.height), self.create_dial)
+        self.screen.blit(dial, dial.get_rect(center=(x, y)))
+
+        s = abs(self.acceleration / 3 * 260)
+        dx, dy = self.needle[min(int(s * 4), len(self.needle) - 1)]
+        pg.draw.line(self.screen, "red", (x, y), (x + dx, y + dy), 5)
         pg.draw.circle(self.screen, "red", (x, y), 5)
 
     def timer(self):
-        seconds = (pg.time.get_ticks() - self.start_ticks) / 1000
-        fontt = pg.font.SysFont("Terminal", 50)
-        text = fontt.render(f"Timer: {seconds}", True, "white")
-        textRect = text.get_rect()
-        textRect.center = (self.width // 2, self.height // 10)
-        self.screen.blit(text, textRect)
+        seconds = self.race_time()
+        self.hud.draw(self.screen, f"Timer: {seconds}", 50, "white", center=(self.width // 2, self.height // 10))
 
     # Creating minimap on screen
     def minimap(self):
-        
-        minimap = pg.transform.scale(pg.image.load(f"resources/track/{self.track.get()}/minimap.png"), (200,200))
-        self.screen.blit(minimap, (self.width - 250, 50))
+        self.screen.blit(self.minimap_image, (self.width - 250, 50))
+
+        if len(self.trail):
+            self.trail[self.trail_index] = self.viewx, self.viewy
+            self.trail_index = (self.trail_index + 1) % len(self.trail)
+            self.trail_count = min(self.trail_count + 1, len(self.trail))
+            if self.trail_count > 1:
+                # oldest position first, then scaled from world to minimap coordinates
+                points = np.roll(self.trail, -self.trail_index, axis=0)[-self.trail_count :]
+                points = points / 30 * 200 + (self.width - 250, 50)
+                pg.draw.lines(self.screen, "yellow", False, points.tolist(), 2)
+
         pg.draw.circle(
             self.screen,
             "white",
-            (self.width - 250 + self.posx / 30 * 200, 50 + self.posy / 30 * 200),
+            (self.width - 250 + self.viewx / 30 * 200, 50 + self.viewy / 30 * 200),
             5,
         )
 
     # Handling ray tracing
     def surface(self):
-        sky = pg.surfarray.array3d(
-            pg.transform.scale(self.sky, (360, self.halfvres * 1.5))
+        sky = self.sky_strip
+        rays = self.rays
+
+        frame = self.frame
+        if self.render_backend == "numba":
+            numba_surface(
+                frame, sky, self.smooth_sky, self.mipmaps, Track.offsets, self.row_levels,
+                self.palette is not None, self.shaded_palette,
+                self.viewx, self.viewy, self.view_rot,
+                rays.angles, rays.cos2, rays.ns, self.shade,
+            )
+        elif self.workers:
+            # numpy releases the GIL, so the tiles of the frame are filled side by side
+            for job in [self.workers.submit(self.render_columns, frame, sky, *tile) for tile in self.tiles]:
+                job.result()
+        else:
+            self.render_columns(frame, sky, 0, self.hres)
+        pg.surfarray.blit_array(self.frame_surface, frame)
+        pg.transform.scale(self.frame_surface, (self.width, self.height), self.view_surface)
+        if self.view_surface.get_parent() is None:
+            self.screen.blit(self.view_surface, (0, 0))
+
+    # Fill the sky and the floor of the screen columns from start to stop
+    def render_columns(self, frame, sky, start, stop):
+        rays = self.rays
+        rots = self.view_rot + rays.angles[start:stop]
+        self.fill_sky(frame, sky, rots, start, stop)
+        frame[start:stop, self.halfvres :] = self.floorcast(
+            rots, rays.cos2[start:stop], rays.ns, self.shade
         )
-        ns = self.halfvres / (
-            (self.halfvres + 0.1 - np.linspace(0, self.halfvres, self.halfvres))
-        )  # depth
-        cos22 = np.cos(
-            np.deg2rad(np.linspace(-30, 30, self.hres) / self.mod)
-        )  # perspective correction
-
-        shade = 0.4 + 0.6 * (
-            np.linspace(0, self.halfvres, self.halfvres) / self.halfvres
+
+    # Copy the sky column of each ray's heading, blending the two nearest degrees when smooth
+    def fill_sky(self, frame, sky, rots, start, stop):
+        heading = np.rad2deg(rots) % 360
+        cols = heading.astype("int") % 360
+        if not self.smooth_sky:
+            frame[start:stop, : self.halfvres] = sky[cols]
+            return
+        frac = (heading - heading.astype("int"))[:, None, None]
+        frame[start:stop, : self.halfvres] = sky[cols] * (1 - frac) + sky[(cols + 1) % 360] * frac
+
+    # Cast every floor ray of the frame in one batch, rows go from horizon to bottom
+    def floorcast(self, rots, cos2, ns, shade):
+        # grid of texture coordinates, one row per column and one entry per depth
+        xs = self.viewx + ns[None, :] * np.cos(rots)[:, None] / cos2[:, None]
+        ys = self.viewy + ns[None, :] * np.sin(rots)[:, None] / cos2[:, None]
+        xxs, yys = (xs / 30 % 1 * 1023).astype("int"), (ys / 30 % 1 * 1023).astype(
+            "int"
         )
-        shade = np.dstack((shade, shade, shade))
-        frame = np.ones([self.hres, self.halfvres * 2, 3])
-        for i in range(self.hres):
-            rot_i = self.rot + np.deg2rad(i / self.mod - 30)
-            sin, cos, cos2 = (
-                np.sin(rot_i),
-                np.cos(rot_i),
-                np.cos(np.deg2rad(i / self.mod - 30)),
-            )
-            frame[i][: self.halfvres] = (
-                sky[int(np.rad2deg(rot_i) % 360)][: self.halfvres] / 255
-            )
-            xs, ys = self.posx + ns * cos / cos2, self.posy + ns * sin / cos2
-            xxs, yys = (xs / 30 % 1 * 1023).astype("int"), (ys / 30 % 1 * 1023).astype(
-                "int"
-            )
-            frame[i][2 * self.halfvres - len(ns) : 2 * self.halfvres] = (
-                shade * self.map[np.flip(xxs), np.flip(yys)] / 255
-            )
-        surf = pg.surfarray.make_surface(frame * 255)
-        surf = pg.transform.scale(surf, (self.width, self.height))
-        self.screen.blit(surf, (0, 0))
-    
+        # read every row from its mip level, the far rows from a small cache resident one
+        levels = self.row_levels
+        texels = Track.offsets[levels] + (xxs >> levels) * (1024 >> levels) + (yys >> levels)
+        if self.palette is not None:
+            return self.shaded_palette[self.palette_rows + self.mipmaps[texels, 0]]
+
+        # uint8 texels times the 1/256 shade stay within uint16, no float intermediates
+        shaded = self.mipmaps[texels] * shade
+        shaded >>= 8
+        return shaded
+
+
+# Resized menu art kept on disk in cache/menu, keyed by the source file, its mtime and
+# size and the target size, so every image is only resized once per screen size.
+# Images are read on worker threads and turned into PhotoImages on the Tk thread,
+# Tk must only be used from the thread that runs the main loop
+class MenuArt:
+
+    def __init__(self, root, cache_dir="cache/menu"):
+        self.root = root
+        self.cache_dir = cache_dir
+        self.workers = ThreadPoolExecutor(max_workers=2)
+        self.images = {}
+
+    def path(self, source, size):
+        stat = os.stat(source)
+        key = f"{os.path.abspath(source)}|{stat.st_mtime_ns}|{stat.st_size}|{size[0]}x{size[1]}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+    # Call done with the PhotoImage of source at size once it is ready
+    def load(self, source, size, done):
+        key = (source, size)
+        if key in self.images:
+            done(self.images[key])
+            return
+        job = self.workers.submit(self.prepare, source, size)
+
+        def deliver():
+            if not job.done():
+                self.root.after(20, deliver)
+                return
+            try:
+                self.images[key] = ImageTk.PhotoImage(job.result())
+            except OSError as e:
+                print(f"Could not load {source}: {e}")
+                return
+            done(self.images[key])
+
+        self.root.after(20, deliver)
+
+    # Resized image from the cache, or resized from the source and cached
+    def prepare(self, source, size):
+        path = self.path(source, size)
+        try:
+            return Image.fromarray(np.load(path))
+        except (OSError, ValueError):
+            pass
+        image = Image.open(source)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image = image.resize(size)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as file:
+                np.save(file, np.asarray(image))
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not cache {source}: {e}")
+        return image
 
 class Menu(Main):
 
-    def __init__(self):
+    def __init__(self, session):
         self.root = Tk()
         super().__init__()
-        pg.mixer.init()
+        self.session = session
+
+        self.settings_writer = SettingsWriter()
+        self.art = MenuArt(self.root)
 
         self.setup_window()
         self.create_styles()
         self.adjust_variables()
-        self.save_settings()
         self.create_main_menu()
+        self.create_track_selection_screen()
         self.create_records()
         self.create_setting_frame()
 
         self.adjust_volume()
         self.setup_music()
 
+    # Runs until a track is picked, the window is only hidden so the next run is instant
     def run(self):
         self.root.mainloop()
 
+    # Back from a race, start over at the main menu
+    def show(self):
+        self.track_selection_frame.pack_forget()
+        self.cv.pack()
+        self.root.deiconify()
+
     def setup_window(self):
         self.width = self.root.winfo_screenwidth()
         self.height = self.root.winfo_screenheight()
         self.root.geometry(f"{self.width}x{self.height}")
         self.root.attributes("-fullscreen", True)
+        self.root.protocol("WM_DELETE_WINDOW", self.quit)
 
     def setup_music(self):
-        pg.mixer.init() 
-        pg.mixer.music.load(r'resources\sound\bg_music.mp3')  
+        pg.mixer.music.load("resources/sound/bg_music.mp3")  
         pg.mixer.music.play(-1) 
 
     def create_styles(self):
@@ -480,25 +1505,19 @@ class Menu(Main):
 
     def adjust_variables(self):
 
-        self.engine_sound.trace_add('write', lambda *args: self.save_settings())
-        self.tire_sound.trace_add('write', lambda *args: self.save_settings())
-        self.master_sound.trace_add('write', lambda *args: self.save_settings())
-        self.music_sound.trace_add('write', lambda *args: self.save_settings())
-        self.master_sound.trace_add('write', lambda *args: self.adjust_volume())
-        self.music_sound.trace_add('write', lambda *args: self.adjust_volume())
-
-        self.steering.trace_add('write', lambda *args: self.save_settings())
+        # one trace per variable, the music volume follows the master and music sliders
+        for variable in (self.engine_sound, self.tire_sound, self.steering):
+            variable.trace_add('write', lambda *args: self.save_settings())
+        for variable in (self.master_sound, self.music_sound):
+            variable.trace_add('write', lambda *args: self.on_volume_change())
 
     def create_main_menu(self):
-        bg = Image.open("resources/env/bg.png")
- 
-        resize_image = bg.resize((self.width, self.height))
-        self.img = ImageTk.PhotoImage(resize_image)  # Store it as an attribute
-
         self.cv = Canvas(self.root, width=self.width, height=self.height)
         self.cv.pack(fill="both", expand=True)
 
-        self.cv.create_image(0, 0, image=self.img, anchor="nw")  # Use the attribute here
+        # the background shows up as soon as it is loaded, the menu does not wait for it
+        background = self.cv.create_image(0, 0, anchor="nw")
+        self.art.load("resources/env/bg.png", (self.width, self.height), lambda image: self.cv.itemconfigure(background, image=image))
         self.cv.create_text(
             self.width / 2,
             100,
@@ -522,10 +1541,10 @@ class Menu(Main):
 
     def start(self):
         self.cv.pack_forget()
-        self.create_track_selection_screen()
         self.track_selection_frame.pack()
 
     def quit(self):
+        self.settings_writer.close()
         sys.exit()
 
     def create_setting_frame(self):
@@ -571,8 +1590,33 @@ class Menu(Main):
         resolution_menu.grid(row=0, column=1, sticky=W)
 
         Checkbutton(tab, text="Show FPS", variable=self.show_fps, background="white").grid(row=2, column=0, sticky=W, padx=10, pady=10)
+        Checkbutton(tab, text="Smooth sky", variable=self.sky_interpolation, background="white", command=self.save_settings).grid(row=2, column=1, sticky=W, padx=10, pady=10)
+
+        Label(tab, text="Renderer", font=("Terminal", 15), background="white").grid(row=1, column=0, sticky=W, padx=10, pady=10)
+        OptionMenu(tab, self.renderer, "numpy", "numba", command=lambda choice: self.save_settings()).grid(row=1, column=1, sticky=W)
+
+        Label(tab, text="Render threads", font=("Terminal", 15), background="white").grid(row=3, column=0, sticky=W, padx=10, pady=10)
+        Scale(tab, from_=1, to=os.cpu_count() or 1, variable=self.render_threads, orient=HORIZONTAL, command=lambda value: self.save_settings()).grid(row=3, column=1, sticky=W, padx=10, pady=10)
+
+        Label(tab, text="Minimap trail", font=("Terminal", 15), background="white").grid(row=4, column=0, sticky=W, padx=10, pady=10)
+        Scale(tab, from_=0, to=500, variable=self.minimap_trail, orient=HORIZONTAL, command=lambda value: self.save_settings()).grid(row=4, column=1, sticky=W, padx=10, pady=10)
+
+        Checkbutton(tab, text="Profiler", variable=self.profiler_enabled, background="white", command=self.save_settings).grid(row=5, column=0, sticky=W, padx=10, pady=10)
+        OptionMenu(tab, self.profile_export, "none", "chrome", "csv", command=lambda choice: self.save_settings()).grid(row=5, column=1, sticky=W)
+
+        Label(tab, text="FPS cap", font=("Terminal", 15), background="white").grid(row=6, column=0, sticky=W, padx=10, pady=10)
+        OptionMenu(tab, self.fps_cap, 0, 30, 60, 120, 144, command=lambda choice: self.save_settings()).grid(row=6, column=1, sticky=W)
+
+        Checkbutton(tab, text="VSync", variable=self.vsync, background="white", command=self.save_settings).grid(row=7, column=0, sticky=W, padx=10, pady=10)
+        Checkbutton(tab, text="Dynamic resolution", variable=self.dynamic_resolution, background="white", command=self.save_settings).grid(row=7, column=1, sticky=W, padx=10, pady=10)
 
-        Button(tab, text="Reset to Default", command=self.reset_graphics_to_default).grid(row=3, column=0, columnspan=2, sticky=W+E, padx=10, pady=10)
+        Checkbutton(tab, text="Mipmaps", variable=self.mipmaps, background="white", command=self.save_settings).grid(row=8, column=0, sticky=W, padx=10, pady=10)
+        Checkbutton(tab, text="256 colours", variable=self.palette_mode, background="white", command=self.save_settings).grid(row=8, column=1, sticky=W, padx=10, pady=10)
+
+        Label(tab, text="Render columns", font=("Terminal", 15), background="white").grid(row=9, column=0, sticky=W, padx=10, pady=10)
+        OptionMenu(tab, self.hres, 120, 240, 480, 960, self.root.winfo_screenwidth(), command=lambda choice: self.save_settings()).grid(row=9, column=1, sticky=W)
+
+        Button(tab, text="Reset to Default", command=self.reset_graphics_to_default).grid(row=10, column=0, columnspan=2, sticky=W+E, padx=10, pady=10)
 
     def on_resolution_change(self, event=None):
         # Save settings whenever the resolution changes
@@ -628,6 +1672,10 @@ class Menu(Main):
 
         Button(tab, text="Reset to Default", command=self.reset_sounds_to_default).grid(row=5, column=0, sticky=W, padx=10, pady=10)
 
+    def on_volume_change(self):
+        self.adjust_volume()
+        self.save_settings()
+
     def adjust_volume(self):
         volume_level = self.music_sound.get() / 10.0 * self.master_sound.get() / 10.0
         pg.mixer.music.set_volume(volume_level)
@@ -643,37 +1691,28 @@ class Menu(Main):
     def create_track_selection_screen(self):
         self.track_selection_frame = Frame(self.root, width=self.width, height=self.height)
         
-        # Load images for each track's map
-        self.track_images = []
-        for i in range(1, 7):  # Assuming there are 6 tracks
-            image = Image.open(f"resources/track/{i}/track.png")
-            resize_image = image.resize((self.width // 6, self.width // 6))  # Resize according to your preference
-            self.track_images.append(ImageTk.PhotoImage(resize_image))
-
-        # Create buttons with track map images
-        for i, img in enumerate(self.track_images, start=1):
-            offset = 550 if i > 3 else 100
-            Label(self.track_selection_frame, text=i, font=("Terminal", 20)).place(x=self.width // 2 - 500 + (i-1)%3 * 400, y=self.height // 10 - 50 + offset)
-            Button(self.track_selection_frame, image=img, command=lambda track_no=i: self.load_game(track_no)).place(x=self.width // 2 - 500 + (i-1)%3 * 400, y=self.height // 10 + offset)
+        # Buttons with each track's map, three tracks per row. The maps are filled in
+        # while the menu is open, the buttons show the track name until then
+        for i, track in enumerate(self.session.tracks):
+            offset = 100 + i // 3 * 450
+            Label(self.track_selection_frame, text=track.number, font=("Terminal", 20)).place(x=self.width // 2 - 500 + i % 3 * 400, y=self.height // 10 - 50 + offset)
+            button = Button(self.track_selection_frame, text=track.name, command=lambda track_no=track.number: self.load_game(track_no))
+            button.place(x=self.width // 2 - 500 + i % 3 * 400, y=self.height // 10 + offset)
+            self.art.load(track.files["texture"], (self.width // 6, self.width // 6), lambda image, button=button: button.configure(image=image))
 
         Button(self.track_selection_frame, text="To main menu", font=("Terminal", 25), command=self.back_to_main_menu).place(x=50, y=50)
 
     def load_game(self, track_no):
         self.track.set(track_no)
         self.save_settings()
-        self.root.destroy()
+        self.settings_writer.flush()  # the game reads the settings from the file
+        self.root.withdraw()
+        self.root.quit()
 
     def back_to_main_menu(self):
         self.track_selection_frame.pack_forget()
         self.cv.pack()
 
-    def load_records(self):
-        try:
-            with open("race_records.json", "r") as file:
-                return json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {str(i): [] for i in range(1, 7)}  # Assuming there are 3 tracks
-
     def create_records(self):
 
         style = ttk.Style()
@@ -685,31 +1724,33 @@ class Menu(Main):
 
         # Checkbox for sorting
         self.sort_var = BooleanVar()
-        sort_checkbox = Checkbutton(self.records_frame, text="Sort by Time", font=("Terminal", 20), variable=self.sort_var, command=self.update_all_tables)
+        sort_checkbox = Checkbutton(self.records_frame, text="Sort by Time", font=("Terminal", 20), variable=self.sort_var, command=self.update_active_table)
         sort_checkbox.place(x=self.width - 300, y= 50)  # Adjust position as needed
 
         tomain = Button(self.records_frame, text="To main menu", font=("Terminal", 25), command=self.back_to_main_menu_from_records)
         tomain.place(x=50, y=50)
 
+        self.records = self.session.records
         self.tables = {}
         self.create_record_tables()
 
+    # Tables start empty, a table is filled when its tab is first shown
     def create_record_tables(self):
-        records_data = self.load_records()
-        for track_number, records in records_data.items():
+        for track in self.session.tracks:
             tab = ttk.Frame(self.records_tab, width=10)
-            table = self.create_record_table(tab, records)
-            self.tables[track_number] = table  # Store the table for later use
-            self.records_tab.add(tab, text=f"Track {track_number}")
+            table = self.create_record_table(tab)
+            self.tables[str(tab)] = RecordView(table, self.records, track.number)  # Store the table for later use
+            self.records_tab.add(tab, text=track.name)
+        self.records_tab.bind("<<NotebookTabChanged>>", lambda event: self.update_active_table())
 
-    def update_all_tables(self):
-        sort = self.sort_var.get()
-        records_data = self.load_records()
-        for track_number, table in self.tables.items():
-            records = records_data[str(track_number)]  # Make sure to convert track_number to string
-            self.update_tableview(table, records, sort)
+    # Only the visible table follows the sort order and new laps, the others catch up when shown
+    def update_active_table(self):
+        view = self.tables.get(self.records_tab.select())
+        if view:
+            view.set_sort(self.sort_var.get())
+            view.refresh()
 
-    def create_record_table(self, tab, records):
+    def create_record_table(self, tab):
 
         # Configure the Treeview style
         style = ttk.Style()
@@ -724,25 +1765,13 @@ class Menu(Main):
         table.column('#1', anchor=CENTER, width=50)
         table.column('#2', anchor=CENTER, width=50)
 
-        for index, record in enumerate(records, start=1):
-            table.insert('', 'end', values=(index, f"{record:.2f}"))
-
         table.pack(expand=YES, fill=BOTH)
         return table
 
-    def update_tableview(self, table, records, sort=False):
-        table.delete(*table.get_children())  # Clear existing rows
-
-        indexed_records = [(index, record) for index, record in enumerate(records, start=1)]
-        if sort:
-            indexed_records.sort(key=lambda x: x[1])
-
-        for index, record in indexed_records:
-            table.insert('', 'end', values=(index, f"{record:.2f}"))
-
     def show_records(self):
         self.cv.pack_forget()
         self.records_frame.pack()
+        self.update_active_table()
 
     def back_to_main_menu_from_records(self):
         self.records_frame.pack_forget()
@@ -761,10 +1790,22 @@ class Menu(Main):
             "steering": self.steering.get(),
             "track": self.track.get(),
             "resolution": self.resolution.get(),
-            "fps": self.show_fps.get()
+            "fps": self.show_fps.get(),
+            "renderer": self.renderer.get(),
+            "render_threads": self.render_threads.get(),
+            "hres": self.hres.get(),
+            "sky_interpolation": self.sky_interpolation.get(),
+            "mipmaps": self.mipmaps.get(),
+            "palette_mode": self.palette_mode.get(),
+            "minimap_trail": self.minimap_trail.get(),
+            "profiler": self.profiler_enabled.get(),
+            "profile_export": self.profile_export.get(),
+            "tick_rate": self.tick_rate.get(),
+            "fps_cap": self.fps_cap.get(),
+            "vsync": self.vsync.get(),
+            "dynamic_resolution": self.dynamic_resolution.get()
         }
-        with open("settings.json", "w") as file:
-            json.dump(settings, file)
+        self.settings_writer.save(settings)
 
     def read_default_settings(self):
         try:
@@ -779,6 +1820,18 @@ class Menu(Main):
         if default_settings:
             self.resolution.set(default_settings["resolution"])
             self.show_fps.set(default_settings["fps"])
+            self.renderer.set(default_settings["renderer"])
+            self.render_threads.set(default_settings["render_threads"])
+            self.hres.set(default_settings["hres"])
+            self.sky_interpolation.set(default_settings["sky_interpolation"])
+            self.mipmaps.set(default_settings["mipmaps"])
+            self.palette_mode.set(default_settings["palette_mode"])
+            self.minimap_trail.set(default_settings["minimap_trail"])
+            self.profiler_enabled.set(default_settings["profiler"])
+            self.profile_export.set(default_settings["profile_export"])
+            self.fps_cap.set(default_settings["fps_cap"])
+            self.vsync.set(default_settings["vsync"])
+            self.dynamic_resolution.set(default_settings["dynamic_resolution"])
             self.save_settings()
 
     def reset_sen_to_default(self):
@@ -806,9 +1859,10 @@ class Menu(Main):
             self.save_settings()
 
 if __name__ == "__main__":
-    
+
+    session = Session()
+    menu = Menu(session)
     while True:
-        menu = Menu()
-        game = Game(menu.show_fps)
         menu.run()
-        game.run()
+        Game(session).run()
+        menu.show()